@@ -1,25 +1,45 @@
 import datetime
-import json
 import logging
 import os
 import pathlib
 import time
 import warnings
-from collections import OrderedDict
-from contextlib import contextmanager
 
-import _pytest.hookspec
 import pytest
 from pytest_metadata.plugin import metadata_key
 
 from . import serialize
 
+# Captured report sections that are added to the test stages
+_STREAM_KEYS = frozenset(("stdout", "stderr"))
+# Reports with up to this many tests are encoded and written in one go, larger
+# ones are written in chunks to limit the memory used for encoding
+_ONE_SHOT_MAX_TESTS = 1000
+# Buffer size for writing the report in chunks, so the many small chunks are
+# collected into few writes
+_WRITE_BUFFER_SIZE = 1 << 18
+
 
 class JSONReportBase:
 
+    # Per-test sections of the report, their label in warnings and the hooks
+    # that contribute to them
+    _SECTIONS = (
+        ("metadata", "Metadata", "pytest_json_runtest_metadata"),
+        ("DUT", "DUT", "pytest_json_runtest_dut"),
+        ("equipment", "equipment", "pytest_json_runtest_equipment"),
+    )
+
     def __init__(self, config=None):
         self._config = config
         self._logger = logging.getLogger()
+        self._log_handler = None
+        # Omitted fields, resolved once in `pytest_configure`
+        self._omit_log = False
+        self._omit_streams = False
+        self._omit_traceback = False
+        self._omit_warnings = False
+        self._section_hooks = ()
 
     def pytest_configure(self, config: pytest.Config) -> None:
         """
@@ -33,8 +53,32 @@ class JSONReportBase:
         if not hasattr(config, "hw_report"):
             self._config.hw_report = self
         # If the user sets --tb=no, always omit the traceback from the report
-        if self._config.option.tbstyle == "no" and not self._must_omit("traceback"):
-            self._config.option.hw_test_report_omit.append("traceback")
+        omit = self._config.option.hw_test_report_omit = set(
+            self._config.option.hw_test_report_omit
+        )
+        if self._config.option.tbstyle == "no":
+            omit.add("traceback")
+        # The omit options are consulted for every test stage, so resolve
+        # them once instead of scanning the option list each time.
+        self._omit_log = "log" in omit
+        self._omit_streams = "streams" in omit
+        self._omit_traceback = "traceback" in omit
+        self._omit_warnings = "warnings" in omit
+        # Bind the hook callers used for every test stage
+        self._section_hooks = tuple(
+            (key, label, getattr(self._config.hook, hookname))
+            for key, label, hookname in self._SECTIONS
+        )
+        # Use a single log handler for the whole session, which is routed to
+        # the current test stage
+        if not self._omit_log and self._log_handler is None:
+            self._log_handler = LoggingHandler()
+            self._logger.addHandler(self._log_handler)
+
+    def pytest_unconfigure(self, config):
+        if self._log_handler is not None:
+            self._logger.removeHandler(self._log_handler)
+            self._log_handler = None
 
     def pytest_addhooks(self, pluginmanager):
         """Add new hooks"""
@@ -43,119 +87,70 @@ class JSONReportBase:
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_protocol(self, item, nextitem):  # pylint: disable=unused-argument
         """Add the hw_report_extra attribute to pytest.Item and then clean up after"""
-        item.hw_report_extra = {}
+        item.hw_report_extra = {
+            "setup": {},
+            "call": {},
+            "teardown": {},
+            "metadata": {},
+            "DUT": {},
+            "equipment": {},
+        }
         yield
         del item.hw_report_extra
 
-    @contextmanager
-    def _capture_log(self, item, when):
-        """Add log to the report"""
-        handler = LoggingHandler()
-        self._logger.addHandler(handler)
-        try:
-            yield
-        finally:
-            self._logger.removeHandler(handler)
-        item.hw_report_extra[when]["log"] = handler.records
+    def _start_log(self):
+        """Start collecting the log records of the next test stage"""
+        if self._log_handler is not None:
+            self._log_handler.records = []
 
-    @pytest.hookimpl(hookwrapper=True)
+    @pytest.hookimpl(tryfirst=True)
     def pytest_runtest_setup(self, item):
-        """Add setup to the report. set up log if not omitted"""
-        item.hw_report_extra["setup"] = {}
-        if self._must_omit("log"):
-            yield
-        else:
-            with self._capture_log(item, "setup"):
-                yield
+        """Start collecting the setup log"""
+        self._start_log()
 
-    @pytest.hookimpl(hookwrapper=True)
+    @pytest.hookimpl(tryfirst=True)
     def pytest_runtest_call(self, item):
-        """Add call to the report. set up log if not omitted"""
-        item.hw_report_extra["call"] = {}
-        if self._must_omit("log"):
-            yield
-        else:
-            with self._capture_log(item, "call"):
-                yield
+        """Start collecting the call log"""
+        self._start_log()
 
-    @pytest.hookimpl(hookwrapper=True)
+    @pytest.hookimpl(tryfirst=True)
     def pytest_runtest_teardown(self, item):
-        """Add teardown to the report. set up log if not omitted"""
-        item.hw_report_extra["teardown"] = {}
-        if self._must_omit("log"):
-            yield
-        else:
-            with self._capture_log(item, "teardown"):
-                yield
+        """Start collecting the teardown log"""
+        self._start_log()
 
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_makereport(self, item, call):
         """Hook runtest_makereport to access the item *and* the report"""
+        extra = item.hw_report_extra
+        stage = extra[call.when]
+        if self._log_handler is not None:
+            # The stage has finished, so stop adding records to its log
+            stage["log"] = self._log_handler.records
+            self._log_handler.records = None
         report = (yield).get_result()
 
-        if not self._must_omit("streams"):
-            streams = {
-                key: val
+        if not self._omit_streams and item._report_sections:
+            stage.update(
+                (key, val)
                 for when_, key, val in item._report_sections
-                if when_ == report.when and key in ["stdout", "stderr"]
-            }
-            item.hw_report_extra[call.when].update(streams)
-
-        for dict_ in self._config.hook.pytest_json_runtest_metadata(item=item, call=call):
-            if not dict_:
-                continue
-            item.hw_report_extra.setdefault("metadata", {}).update(dict_)
-        self._validate_metadata(item)
-
-        for dict_ in self._config.hook.pytest_json_runtest_dut(item=item, call=call):
-            if not dict_:
-                continue
-            item.hw_report_extra.setdefault("DUT", {}).update(dict_)
-        self._validate_dut(item)
-
-        for dict_ in self._config.hook.pytest_json_runtest_equipment(item=item, call=call):
-            if not dict_:
-                continue
-            item.hw_report_extra.setdefault("equipment", {}).update(dict_)
-        self._validate_equipment(item)
+                if when_ == report.when and key in _STREAM_KEYS
+            )
+
+        for key, label, hook in self._section_hooks:
+            for dict_ in hook(item=item, call=call):
+                if not dict_:
+                    continue
+                extra[key].update(dict_)
+            # Ensure that the section is JSON-serializable, otherwise clear it
+            section = extra[key]
+            if section and not serialize.serializable(section):
+                warnings.warn(f"{label} of {item.nodeid} is not JSON-serializable.")
+                extra[key] = {}
 
         # Attach the JSON details to the report. If this is an xdist worker,
         # the details will be serialized and relayed with the other attributes
         # of the report.
-        report.hw_report_extra = item.hw_report_extra  # type: ignore[attr-defined]
-
-    @staticmethod
-    def _validate_metadata(item):
-        """Ensure that `item` has JSON-serializable metadata, otherwise delete
-        it."""
-        if "metadata" not in item.hw_report_extra:
-            return
-        if not serialize.serializable(item.hw_report_extra["metadata"]):
-            warnings.warn(f"Metadata of {item.nodeid} is not JSON-serializable.")
-            del item.hw_report_extra["metadata"]
-
-    @staticmethod
-    def _validate_dut(item):
-        """Ensure that `item` has JSON-serializable DUT, otherwise delete
-        it."""
-        if "DUT" not in item.hw_report_extra:
-            return
-        if not serialize.serializable(item.hw_report_extra["DUT"]):
-            warnings.warn(f"DUT of {item.nodeid} is not JSON-serializable.")
-            del item.hw_report_extra["DUT"]
-
-    @staticmethod
-    def _validate_equipment(item):
-        """Ensure that `item` has JSON-serializable equipment, otherwise delete
-        it."""
-        if "equipment" not in item.hw_report_extra:
-            return
-        if not serialize.serializable(item.hw_report_extra["equipment"]):
-            warnings.warn(f"equipment of {item.nodeid} is not JSON-serializable.")
-            del item.hw_report_extra["equipment"]
-
-    def _must_omit(self, key):
-        return key in self._config.option.hw_test_report_omit
+        report.hw_report_extra = extra  # type: ignore[attr-defined]
 
 
 class JSONReport(JSONReportBase):
@@ -164,13 +159,20 @@ class JSONReport(JSONReportBase):
     def __init__(self, *args, **kwargs):
         JSONReportBase.__init__(self, *args, **kwargs)
         self._start_time = None
-        self._json_tests = OrderedDict()
+        self._json_tests = {}
         self._json_warnings = []
         self._num_deselected = 0
         self._terminal_summary = ""
         # Min verbosity required to print to terminal
         self._terminal_min_verbosity = 0
         self.report = None
+        self._hook_stage = None
+        self._hook_teststatus = None
+
+    def pytest_configure(self, config: pytest.Config) -> None:
+        super().pytest_configure(config)
+        self._hook_stage = self._config.hook.pytest_json_runtest_stage
+        self._hook_teststatus = self._config.hook.pytest_report_teststatus
 
     def pytest_sessionstart(self, session):
         self._start_time = time.time()
@@ -187,6 +189,11 @@ class JSONReport(JSONReportBase):
         except KeyError:
             json_testitem = serialize.make_testitem(nodeid)
             self._json_tests[nodeid] = json_testitem
+        else:
+            if isinstance(json_testitem, serialize.EncodedTestItem):
+                # The test is reported again after its teardown (e.g. when it's
+                # rerun), so go on with the decoded item
+                json_testitem = self._json_tests[nodeid] = json_testitem.load()
 
         metadata = report.hw_report_extra.get("metadata")
         if metadata:
@@ -210,10 +217,17 @@ class JSONReport(JSONReportBase):
 
         # Update total test outcome, if necessary. The total outcome can be
         # different from the outcome of the setup/call/teardown stage.
-        outcome = self._config.hook.pytest_report_teststatus(report=report, config=self._config)[0]
+        outcome = self._hook_teststatus(report=report, config=self._config)[0]
         if outcome not in ["passed", ""]:
             json_testitem["outcome"] = outcome
-        json_testitem[report.when] = self._config.hook.pytest_json_runtest_stage(report=report)
+        json_testitem[report.when] = self._hook_stage(report=report)
+
+        # The test item is complete after teardown, so encode it right away
+        # instead of holding on to the objects until the session finishes
+        if report.when == "teardown" and self._config.option.hw_test_report_eager_encode:
+            self._json_tests[nodeid] = serialize.EncodedTestItem(
+                json_testitem, self._config.option.hw_test_report_indent
+            )
 
     @pytest.hookimpl(trylast=True)
     def pytest_json_runtest_stage(self, report):
@@ -224,7 +238,7 @@ class JSONReport(JSONReportBase):
             stage_details.get("stdout"),
             stage_details.get("stderr"),
             stage_details.get("log"),
-            self._must_omit("traceback"),
+            self._omit_traceback,
         )
 
     @pytest.hookimpl(tryfirst=True)
@@ -238,9 +252,10 @@ class JSONReport(JSONReportBase):
         if self._num_deselected:
             summary_data["deselected"] = self._num_deselected
 
+        now = time.time()
         json_report = serialize.make_report(
-            created=datetime.datetime.fromtimestamp(time.time()).isoformat(),
-            duration=time.time() - self._start_time,
+            created=datetime.datetime.fromtimestamp(now).isoformat(),
+            duration=now - self._start_time,
             exitcode=session.exitstatus,
             root=str(session.fspath),
             environment=self._config.stash.get(metadata_key, {}),
@@ -276,31 +291,26 @@ class JSONReport(JSONReportBase):
         if self.report is None:
             raise ValueError("could not save report: no report available")
         # Create path if it doesn't exist
-        dirname = path.parent
-        if dirname:
-            dirname.mkdir(exist_ok=True)
-
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(
-                self.report,
-                f,
-                default=str,
-                indent=self._config.option.hw_test_report_indent,
-            )
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        indent = self._config.option.hw_test_report_indent
+        if (
+            len(self.report.get("tests", ())) <= _ONE_SHOT_MAX_TESTS
+            and not self._config.option.hw_test_report_eager_encode
+        ):
+            path.write_bytes(serialize.dumps(self.report, indent))
+        else:
+            with open(path, "wb", buffering=_WRITE_BUFFER_SIZE) as f:
+                f.writelines(serialize.iterencode_report(self.report, indent))
 
     def pytest_warning_recorded(self, warning_message, when):
         if self._config is None:
             # If pytest is invoked directly from code, it may try to capture
             # warnings before the config is set.
             return
-        if not self._must_omit("warnings"):
+        if not self._omit_warnings:
             self._json_warnings.append(serialize.make_warning(warning_message, when))
 
-    # Warning hook fallback (warning_recorded is available from pytest>=6)
-    if not hasattr(_pytest.hookspec, "pytest_warning_recorded"):
-        pytest_warning_captured = pytest_warning_recorded
-        del pytest_warning_recorded
-
     def pytest_terminal_summary(self, terminalreporter):
         if self._terminal_min_verbosity > (
             self._config.option.hw_test_report_verbosity
@@ -321,14 +331,33 @@ class LoggingHandler(logging.Handler):
 
     def __init__(self):
         super().__init__()
-        self.records = []
+        # List of the current test stage's records, None outside test stages
+        self.records = None
+        self._formatter = logging.Formatter()
 
     def emit(self, record):
-        d = dict(record.__dict__)
-        d["msg"] = record.getMessage()
-        d["args"] = None
-        d["exc_info"] = None
-        d.pop("message", None)
+        if self.records is None:
+            return
+        # Only keep the fields the report needs instead of copying the whole
+        # record, which also holds args and exception info
+        d = {
+            "name": record.name,
+            "msg": record.getMessage(),
+            "levelname": record.levelname,
+            "levelno": record.levelno,
+            "pathname": record.pathname,
+            "lineno": record.lineno,
+            "funcName": record.funcName,
+            "created": record.created,
+            "msecs": record.msecs,
+        }
+        exc_text = record.exc_text
+        if exc_text is None and record.exc_info:
+            exc_text = self._formatter.formatException(record.exc_info)
+        if exc_text:
+            d["exc_text"] = exc_text
+        if record.stack_info:
+            d["stack_info"] = record.stack_info
         self.records.append(d)
 
 
@@ -441,6 +470,13 @@ def pytest_addoption(parser):
         action="store_true",
         help="only create a summary without per-test details",
     )
+    group.addoption(
+        "--hw-test-report-eager-encode",
+        default=False,
+        action="store_true",
+        help="encode each test item as soon as the test has finished (test items "
+        "are then only available as encoded JSON to hooks and scripts)",
+    )
     group.addoption(
         "--hw-test-report-indent",
         type=int,
@@ -2,19 +2,135 @@
 
 """
 
+import functools
 import json
 from collections import Counter
 
 
+@functools.lru_cache(maxsize=None)
+def _orjson():
+    """Return the orjson module, or None if it isn't installed.
+
+    orjson is imported on first use, so it isn't loaded unless a report is
+    actually saved.
+    """
+    try:
+        import orjson  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return orjson
+
+
 def serializable(obj):
     """Return whether `obj` is JSON-serializable."""
+    # Probing with the C encoder bails out on the first unsupported object,
+    # which is faster than walking the structure in Python.
     try:
         json.dumps(obj)
-    except (TypeError, OverflowError):
+    except (TypeError, ValueError, OverflowError):
+        # ValueError is raised for circular references
         return False
     return True
 
 
+def dumps(obj, indent=None):
+    """Return `obj` encoded as JSON bytes.
+
+    Uses orjson if it's installed and supports the indentation level, otherwise
+    falls back to the standard library. Objects that aren't JSON-serializable
+    are converted with `str`.
+    """
+    orjson = _orjson()
+    if orjson is not None and indent in (None, 2):
+        # Let `default` convert datetimes and dataclasses, so they are encoded
+        # the same way as by the standard library
+        option = (
+            orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+        )
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=str, option=option)
+        except orjson.JSONEncodeError:
+            # orjson is stricter than the standard library, e.g. it can't
+            # encode integers exceeding 64 bit
+            pass
+    return json.dumps(obj, default=str, indent=indent).encode()
+
+
+class EncodedTestItem(bytes):
+    """JSON encoding of a test item, written to the report as it is.
+
+    The outcome is kept, so the summary can be made without decoding the item.
+    """
+
+    def __new__(cls, item, indent=None):
+        self = super().__new__(cls, dumps(item, indent))
+        self.outcome = item["outcome"]
+        return self
+
+    def load(self):
+        """Return the decoded test item."""
+        return json.loads(self)
+
+
+def iterencode_report(report, indent=None):
+    """Yield the JSON encoding of `report` as chunks of bytes.
+
+    The test items are encoded one at a time, so the encoding of the whole
+    report is never held in memory at once. The output is equivalent to encoding
+    the report in one go.
+    """
+    if not report:
+        yield b"{}"
+        return
+    if indent is None:
+        newline = b""
+        # Match the separators of the encoder used for the values: orjson's
+        # compact output has no spaces, the standard library's has
+        if _orjson() is not None:
+            separator, colon = b",", b":"
+        else:
+            separator, colon = b", ", b": "
+    else:
+        newline = b"\n" + b" " * indent
+        separator, colon = b",", b": "
+    for i, (key, value) in enumerate(report.items()):
+        yield (separator if i else b"{") + newline + _dumps_key(key) + colon
+        if key == "tests" and isinstance(value, list) and value:
+            item_newline = newline + b" " * (indent or 0)
+            for j, item in enumerate(value):
+                yield (separator if j else b"[") + item_newline
+                if not isinstance(item, EncodedTestItem):
+                    item = dumps(item, indent)
+                yield _reindent(item, item_newline, indent)
+            yield newline + b"]"
+        else:
+            yield _reindent(dumps(value, indent), newline, indent)
+    yield b"}" if indent is None else b"\n}"
+
+
+def _dumps_key(key):
+    """Return `key` encoded as JSON object key.
+
+    Keys that aren't strings are converted like `json.dumps` does, e.g. `1`
+    becomes `"1"` and `None` becomes `"null"`.
+    """
+    if isinstance(key, str):
+        return dumps(key)
+    # Cut the key out of the encoding of a one-item object
+    return json.dumps({key: 0})[1:-4].encode()
+
+
+def _reindent(data, newline, indent):
+    """Indent the encoded JSON `data` to the nesting level given by `newline`."""
+    if indent is None:
+        return data
+    return data.replace(b"\n", newline)
+
+
 def make_collector(report, result):
     """Return JSON-serializable collector node."""
     collector = {
@@ -102,7 +218,9 @@ def make_fileloc(loc):
 
 def make_summary(tests, **kwargs):
     """Return JSON-serializable test result summary."""
-    summary = Counter([t["outcome"] for t in tests.values()])
+    summary = Counter(
+        [t.outcome if isinstance(t, EncodedTestItem) else t["outcome"] for t in tests.values()]
+    )
     summary["total"] = sum(summary.values())
     summary.update(kwargs)
     return summary
@@ -1,5 +1,18 @@
+import hashlib
+import importlib.metadata
+import pathlib
+import shutil
+import sys
+
 import pytest
 
+import pytest_htr
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 pytest_plugins = "pytester"
 
 miss_map = {
@@ -82,6 +95,97 @@ def test_parametrized(x):
 """
 
 
+@pytest.fixture(scope="session")
+def file_source(tmp_path_factory):
+    """FILE written to disk once per session."""
+    path = tmp_path_factory.mktemp("file_source") / "test_file.py"
+    # Strip the source like pytester.makepyfile() does, so line numbers match
+    path.write_text(FILE.strip() + "\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def file_example(pytester, file_source):
+    """Copy FILE into the pytester directory."""
+    return shutil.copy(file_source, pytester.path)
+
+
+@pytest.fixture
+def report_path(pytester):
+    """Path of the report saved by default in the pytester directory."""
+    return pytester.path / ".report.json"
+
+
+def load_report(path):
+    """Return the parsed JSON report at `path`."""
+    return json_loads(path.read_bytes())
+
+
+def items_by_name(tests):
+    """Return the test items keyed by their test function name without the
+    "test_" prefix."""
+    return {test["nodeid"].rpartition("::")[2][5:]: test for test in tests}
+
+
+_DEFAULT_REPORT_CACHE_KEY = "pytest_htr/default_report"
+
+
+# Plugins that are loaded automatically and shape the default report
+_DEFAULT_REPORT_PLUGINS = ("pytest-metadata", "pytest-xdist", "flaky")
+
+
+def _default_report_key():
+    """Hash of FILE, this conftest (which holds the invocation), the plugin
+    sources and the versions of Python, pytest and the autoloaded plugins."""
+    h = hashlib.sha256(FILE.encode())
+    h.update(pathlib.Path(__file__).read_bytes())
+    for src in sorted(pathlib.Path(pytest_htr.__file__).parent.glob("*.py")):
+        h.update(src.read_bytes())
+    h.update(sys.version.encode())
+    h.update(pytest.__version__.encode())
+    for dist in _DEFAULT_REPORT_PLUGINS:
+        try:
+            version = importlib.metadata.version(dist)
+        except importlib.metadata.PackageNotFoundError:
+            version = ""
+        h.update(f"{dist}={version}".encode())
+    return h.hexdigest()
+
+
+@pytest.fixture(scope="module")
+def default_report(request, tmp_path_factory, file_source):
+    """Report of running FILE with `--hw-test-report`.
+
+    Running pytest is expensive, so the report is created once and shared by
+    all tests of a module that only read it. It is also kept in the pytest
+    cache, keyed on everything it depends on, so reruns can skip the run.
+    """
+    cache = getattr(request.config, "cache", None)
+    key = _default_report_key()
+    if cache is not None:
+        cached = cache.get(_DEFAULT_REPORT_CACHE_KEY, None)
+        if cached is not None and cached.get("key") == key:
+            return cached["report"]
+    path = tmp_path_factory.mktemp("default_report")
+    shutil.copy(file_source, path / "test_default_report.py")
+    # Run in-process rather than in a subprocess, isolated like pytester does
+    # for the inline runs
+    modules = dict(sys.modules)
+    try:
+        with pytest.MonkeyPatch.context() as mp:
+            mp.chdir(path)
+            mp.setattr(sys, "path", list(sys.path))
+            mp.delenv("PYTEST_ADDOPTS", raising=False)
+            pytest.main(["--hw-test-report", "-p", "no:cacheprovider", str(path)])
+    finally:
+        sys.modules.clear()
+        sys.modules.update(modules)
+    report = load_report(path / ".report.json")
+    if cache is not None:
+        cache.set(_DEFAULT_REPORT_CACHE_KEY, {"key": key, "report": report})
+    return report
+
+
 @pytest.fixture
 def match_reports():
     def f(a, b):
@@ -2,19 +2,25 @@
 
 import json
 import logging
+import operator
 import pathlib
+import shutil
+import subprocess
 import sys
 
 import pytest
 
-from pytest_htr.plugin import JSONReport
+from pytest_htr import serialize
+from pytest_htr.plugin import JSONReport, LoggingHandler
 
-from .conftest import FILE
+from .conftest import items_by_name, load_report, normalize_report
 
+_top_level_getter = operator.itemgetter("created", "duration", "root", "exitcode")
 
+
+@pytest.mark.usefixtures("file_example")
 def test_arguments_in_help(pytester: pytest.Pytester) -> None:
     """Test to ensure that options are present in the help print"""
-    pytester.makepyfile(FILE)
     res = pytester.runpytest("--help")
     res.stdout.fnmatch_lines(
         [
@@ -24,85 +30,82 @@ def test_arguments_in_help(pytester: pytest.Pytester) -> None:
     )
 
 
-def test_no_report(pytester: pytest.Pytester) -> None:
-    pytester.makepyfile(FILE)
+@pytest.mark.usefixtures("file_example")
+def test_no_report(pytester: pytest.Pytester, report_path: pathlib.Path) -> None:
     pytester.runpytest()
-    assert not (pytester.path / ".report.json").exists()
+    assert not report_path.exists()
 
 
-def test_create_report(pytester: pytest.Pytester) -> None:
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    assert (pytester.path / ".report.json").exists()
+@pytest.mark.usefixtures("file_example")
+def test_create_report(pytester: pytest.Pytester, report_path: pathlib.Path) -> None:
+    pytester.runpytest("--hw-test-report", "--hw-test-report-omit", "streams", "log")
+    assert report_path.exists()
 
 
-@pytest.mark.parametrize("file_path", ["arg.json", "x/report.json"])
+@pytest.mark.usefixtures("file_example")
+@pytest.mark.parametrize("file_path", ["arg.json", "x/report.json", "x/y/report.json"])
 def test_create_report_file_from_arg(pytester: pytest.Pytester, file_path: str) -> None:
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report", f"--hw-test-report-file={file_path}")
+    pytester.runpytest(
+        "--hw-test-report",
+        f"--hw-test-report-file={file_path}",
+        "--hw-test-report-omit",
+        "streams",
+        "log",
+    )
     assert (pytester.path / file_path).exists()
 
 
-def test_create_no_report(pytester):
-    pytester.makepyfile(FILE)
+@pytest.mark.usefixtures("file_example")
+def test_create_no_report(pytester, report_path):
     pytester.runpytest("--hw-test-report", "--hw-test-report-file=NONE")
-    assert not (pytester.path / ".report.json").exists()
-
-
-def test_terminal_summary(pytester):
-    pytester.makepyfile(FILE)
-    res = pytester.runpytest("--hw-test-report")
-    res.stdout.fnmatch_lines(["-*JSON report*-", "*report saved*.report.json*"])
-
-    res = pytester.runpytest("--hw-test-report", "--hw-test-report-file=./")
-    res.stdout.fnmatch_lines(["*could not save report*"])
-
-    res = pytester.runpytest("--hw-test-report", "--hw-test-report-file=NONE")
-    res.stdout.no_fnmatch_line("-*JSON report*-")
-
-    res = pytester.runpytest("--hw-test-report", "--hw-test-report-file=NONE", "-v")
-    res.stdout.fnmatch_lines(["*auto-save skipped*"])
-
-    res = pytester.runpytest("--hw-test-report", "-q")
-    res.stdout.no_fnmatch_line("-*JSON report*-")
-
-    res = pytester.runpytest("--hw-test-report", "-q", "--hw-test-report-verbosity=0")
-    res.stdout.fnmatch_lines(["-*JSON report*-"])
-
-    res = pytester.runpytest(
-        "--hw-test-report", "--hw-test-report-file=NONE", "-vv", "--hw-test-report-verbosity=0"
-    )
-    res.stdout.no_fnmatch_line("-*JSON report*-")
+    assert not report_path.exists()
 
 
-def test_report_keys(pytester):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    keys = set(
-        [
-            "created",
-            "duration",
-            "environment",
-            "tests",
-            "summary",
-            "root",
-            "exitcode",
-        ]
-    )
-    assert set(data) == keys
-    assert isinstance(data["created"], str)
-    assert isinstance(data["duration"], float)
-    assert pathlib.Path.is_absolute(pathlib.Path(data["root"]))
-    assert data["exitcode"] == 1
+@pytest.mark.parametrize(
+    "args, lines, absent_line",
+    [
+        ([], ["-*JSON report*-", "*report saved*.report.json*"], None),
+        (["--hw-test-report-file=./"], ["*could not save report*"], None),
+        (["--hw-test-report-file=NONE"], [], "-*JSON report*-"),
+        (["--hw-test-report-file=NONE", "-v"], ["*auto-save skipped*"], None),
+        (["-q"], [], "-*JSON report*-"),
+        (["-q", "--hw-test-report-verbosity=0"], ["-*JSON report*-"], None),
+        (
+            ["--hw-test-report-file=NONE", "-vv", "--hw-test-report-verbosity=0"],
+            [],
+            "-*JSON report*-",
+        ),
+    ],
+)
+@pytest.mark.usefixtures("file_example")
+def test_terminal_summary(pytester, args, lines, absent_line):
+    res = pytester.runpytest("--hw-test-report", *args)
+    res.stdout.fnmatch_lines(lines)
+    if absent_line is not None:
+        res.stdout.no_fnmatch_line(absent_line)
+
+
+def test_report_keys(default_report):
+    data = default_report
+    keys = {
+        "created",
+        "duration",
+        "environment",
+        "tests",
+        "summary",
+        "root",
+        "exitcode",
+    }
+    assert data.keys() == keys
+    created, duration, root, exitcode = _top_level_getter(data)
+    assert isinstance(created, str)
+    assert isinstance(duration, float)
+    assert pathlib.Path(root).is_absolute()
+    assert exitcode == 1
 
 
-def test_report_summary(pytester):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+def test_report_summary(default_report):
+    data = default_report
     assert data["summary"] == {
         "total": 10,
         "passed": 2,
@@ -115,91 +118,85 @@ def test_report_summary(pytester):
     }
 
 
-def test_report_item_keys(pytester):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
-    assert set(tests["pass"]) == set(["nodeid", "outcome", "setup", "call", "teardown"])
+def test_report_item_keys(default_report):
+    data = default_report
+    tests = items_by_name(data["tests"])
+    assert set(tests["pass"]) == {"nodeid", "outcome", "setup", "call", "teardown"}
 
 
-def test_report_outcomes(pytester):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
-    assert len(tests) == 10
-    assert tests["pass"]["outcome"] == "passed"
-    assert tests["fail_with_fixture"]["outcome"] == "failed"
-    assert tests["xfail"]["outcome"] == "xfailed"
-    assert tests["xfail_but_passing"]["outcome"] == "xpassed"
-    assert tests["fail_during_setup"]["outcome"] == "error"
-    assert tests["fail_during_teardown"]["outcome"] == "error"
-    assert tests["skip"]["outcome"] == "skipped"
-
-
-def test_report_longrepr(pytester):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+def test_report_num_tests(default_report):
+    assert len(items_by_name(default_report["tests"])) == 10
+
+
+@pytest.mark.parametrize(
+    "name, outcome",
+    [
+        ("pass", "passed"),
+        ("fail_with_fixture", "failed"),
+        ("xfail", "xfailed"),
+        ("xfail_but_passing", "xpassed"),
+        ("fail_during_setup", "error"),
+        ("fail_during_teardown", "error"),
+        ("skip", "skipped"),
+    ],
+)
+def test_report_outcomes(default_report, name, outcome):
+    tests = items_by_name(default_report["tests"])
+    assert tests[name]["outcome"] == outcome
+
+
+def test_report_longrepr(default_report):
+    data = default_report
+    tests = items_by_name(data["tests"])
     assert "assert False" in tests["fail_with_fixture"]["call"]["longrepr"]
 
 
-def test_report_crash_and_traceback(pytester):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+def test_report_crash_and_traceback(default_report):
+    tests = items_by_name(default_report["tests"])
 
     assert "traceback" not in tests["pass"]["call"]
 
     call = tests["fail_nested"]["call"]
-    assert call["crash"]["path"].endswith("test_report_crash_and_traceback.py")
+    assert call["crash"]["path"].endswith("test_default_report.py")
     assert call["crash"]["lineno"] == 55
     assert call["crash"]["message"].startswith("TypeError: unsupported ")
     if sys.version_info.minor < 12:
         traceback = [
-            {"path": "test_report_crash_and_traceback.py", "lineno": 66, "message": ""},
-            {"path": "test_report_crash_and_traceback.py", "lineno": 64, "message": "in foo"},
+            {"path": "test_default_report.py", "lineno": 66, "message": ""},
+            {"path": "test_default_report.py", "lineno": 64, "message": "in foo"},
             {
-                "path": "test_report_crash_and_traceback.py",
+                "path": "test_default_report.py",
                 "lineno": 64,
                 "message": "in <listcomp>",
             },
-            {"path": "test_report_crash_and_traceback.py", "lineno": 60, "message": "in bar"},
-            {"path": "test_report_crash_and_traceback.py", "lineno": 55, "message": "TypeError"},
+            {"path": "test_default_report.py", "lineno": 60, "message": "in bar"},
+            {"path": "test_default_report.py", "lineno": 55, "message": "TypeError"},
         ]
     else:
         traceback = [
-            {"path": "test_report_crash_and_traceback.py", "lineno": 66, "message": ""},
-            {"path": "test_report_crash_and_traceback.py", "lineno": 64, "message": "in foo"},
-            {"path": "test_report_crash_and_traceback.py", "lineno": 60, "message": "in bar"},
-            {"path": "test_report_crash_and_traceback.py", "lineno": 55, "message": "TypeError"},
+            {"path": "test_default_report.py", "lineno": 66, "message": ""},
+            {"path": "test_default_report.py", "lineno": 64, "message": "in foo"},
+            {"path": "test_default_report.py", "lineno": 60, "message": "in bar"},
+            {"path": "test_default_report.py", "lineno": 55, "message": "TypeError"},
         ]
     assert call["traceback"] == traceback
 
 
 @pytest.mark.parametrize("tb_style", ["long", "short"])
-def test_report_traceback_styles(pytester, tb_style):
+def test_report_traceback_styles(pytester, report_path, tb_style):
     pytester.makepyfile(
         """
     def test_raise(): assert False
     def test_raise_nested(): f = lambda: g; f()"""
     )
     pytester.runpytest("--hw-test-report", f"--tb={tb_style}")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     for i in (0, 1):
         assert isinstance(data["tests"][i]["call"]["traceback"], list)
 
 
 @pytest.mark.parametrize("tb_style", ["native", "line", "no"])
-def test_report_traceback_styles2(pytester, tb_style):
+def test_report_traceback_styles2(pytester, report_path, tb_style):
     pytester.makepyfile(
         """
         def test_raise(): assert False
@@ -207,58 +204,50 @@ def test_report_traceback_styles2(pytester, tb_style):
         """
     )
     pytester.runpytest("--hw-test-report", f"--tb={tb_style}")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
     for i in (0, 1):
         assert "traceback" not in data["tests"][i]["call"]
 
 
-def test_no_traceback(pytester):
-    pytester.makepyfile(FILE)
+@pytest.mark.usefixtures("file_example")
+def test_no_traceback(pytester, report_path):
     pytester.runpytest("--hw-test-report", "--hw-test-report-omit=traceback")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+    data = load_report(report_path)
+    tests = items_by_name(data["tests"])
     assert "traceback" not in tests["fail_nested"]["call"]
 
 
-def test_pytest_no_traceback(pytester):
-    pytester.makepyfile(FILE)
+@pytest.mark.usefixtures("file_example")
+def test_pytest_no_traceback(pytester, report_path):
     pytester.runpytest("--hw-test-report", "--tb=no")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+    data = load_report(report_path)
+    tests = items_by_name(data["tests"])
     assert "traceback" not in tests["fail_nested"]["call"]
 
 
-def test_no_streams(pytester):
-    pytester.makepyfile(FILE)
+@pytest.mark.usefixtures("file_example")
+def test_no_streams(pytester, report_path):
     pytester.runpytest("--hw-test-report", "--hw-test-report-omit=streams")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+    data = load_report(report_path)
+    tests = items_by_name(data["tests"])
     call = tests["fail_with_fixture"]["call"]
     assert "stdout" not in call
     assert "stderr" not in call
 
 
-def test_summary_only(pytester):
-    pytester.makepyfile(FILE)
+@pytest.mark.usefixtures("file_example")
+def test_summary_only(pytester, report_path):
     pytester.runpytest("--hw-test-report", "--hw-test-report-summary")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     assert "summary" in data
     assert "tests" not in data
     assert "warnings" not in data
 
 
-def test_report_streams(pytester):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+def test_report_streams(default_report):
+    data = default_report
+    tests = items_by_name(data["tests"])
 
     test = tests["fail_with_fixture"]
     assert test["setup"]["stdout"] == "setup\n"
@@ -271,7 +260,7 @@ def test_report_streams(pytester):
     assert "stderr" not in tests["pass"]["call"]
 
 
-def test_record_property(pytester):
+def test_record_property(pytester, report_path):
     pytester.makepyfile(
         """
         def test_record_property(record_property):
@@ -288,10 +277,9 @@ def test_record_property(pytester):
     """
     )
     pytester.runpytest("-vv", "--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+    tests = items_by_name(data["tests"])
     assert tests["record_property"]["user_properties"] == [
         {"foo": 42},
         {"bar": ["baz", {"x": "y"}]},
@@ -304,7 +292,7 @@ def test_record_property(pytester):
     )
 
 
-def test_json_dut(pytester):
+def test_json_dut(pytester, report_path):
     pytester.makepyfile(
         """
         def test_dut1(json_dut):
@@ -336,10 +324,9 @@ def test_json_dut(pytester):
     """
     )
     pytester.runpytest("-vv", "--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+    tests = items_by_name(data["tests"])
     assert tests["dut1"]["DUT"] == {"x": "foo", "y": [1, {"a": 2}]}
     assert tests["dut2"]["DUT"] == {"z": 1}
     assert "DUT" not in tests["unused_dut"]
@@ -348,10 +335,11 @@ def test_json_dut(pytester):
     assert len(data["warnings"]) == 1 and (
         "test_unserializable_dut is not JSON-serializable" in data["warnings"][0]["message"]
     )
+    assert data["warnings"][0]["message"].startswith("DUT of ")
     assert tests["multi_stage_dut"]["DUT"] == {"a": 1, "b": 2, "c": 3}
 
 
-def test_dut_fixture_without_report_flag(pytester):
+def test_dut_fixture_without_report_flag(pytester, report_path):
     """Using the json_metadata fixture without --json-report should not raise
     internal errors."""
     pytester.makepyfile(
@@ -362,10 +350,10 @@ def test_dut_fixture_without_report_flag(pytester):
     )
     res = pytester.runpytest()
     assert res.ret == 0
-    assert not (pytester.path / ".report.json").exists()
+    assert not report_path.exists()
 
 
-def test_json_equipment(pytester):
+def test_json_equipment(pytester, report_path):
     pytester.makepyfile(
         """
         def test_equipment1(json_equipment):
@@ -397,10 +385,9 @@ def test_json_equipment(pytester):
     """
     )
     pytester.runpytest("-vv", "--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+    tests = items_by_name(data["tests"])
     assert tests["equipment1"]["equipment"] == {"x": "foo", "y": [1, {"a": 2}]}
     assert tests["equipment2"]["equipment"] == {"z": 1}
     assert "equipment" not in tests["unused_equipment"]
@@ -409,10 +396,11 @@ def test_json_equipment(pytester):
     assert len(data["warnings"]) == 1 and (
         "test_unserializable_equipment is not JSON-serializable" in data["warnings"][0]["message"]
     )
+    assert data["warnings"][0]["message"].startswith("equipment of ")
     assert tests["multi_stage_equipment"]["equipment"] == {"a": 1, "b": 2, "c": 3}
 
 
-def test_equipment_fixture_without_report_flag(pytester):
+def test_equipment_fixture_without_report_flag(pytester, report_path):
     """Using the json_metadata fixture without --json-report should not raise
     internal errors."""
     pytester.makepyfile(
@@ -423,10 +411,10 @@ def test_equipment_fixture_without_report_flag(pytester):
     )
     res = pytester.runpytest()
     assert res.ret == 0
-    assert not (pytester.path / ".report.json").exists()
+    assert not report_path.exists()
 
 
-def test_json_metadata(pytester):
+def test_json_metadata(pytester, report_path):
     pytester.makepyfile(
         """
         def test_metadata1(json_metadata):
@@ -458,10 +446,9 @@ def test_json_metadata(pytester):
     """
     )
     pytester.runpytest("-vv", "--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
-    tests = {test["nodeid"].split("::")[-1][5:]: test for test in data["tests"]}
+    tests = items_by_name(data["tests"])
     assert tests["metadata1"]["metadata"] == {"x": "foo", "y": [1, {"a": 2}]}
     assert tests["metadata2"]["metadata"] == {"z": 1}
     assert "metadata" not in tests["unused_metadata"]
@@ -470,10 +457,25 @@ def test_json_metadata(pytester):
     assert len(data["warnings"]) == 1 and (
         "test_unserializable_metadata is not JSON-serializable" in data["warnings"][0]["message"]
     )
+    assert data["warnings"][0]["message"].startswith("Metadata of ")
     assert tests["multi_stage_metadata"]["metadata"] == {"a": 1, "b": 2, "c": 3}
 
 
-def test_metadata_fixture_without_report_flag(pytester):
+def test_circular_metadata(pytester, report_path):
+    pytester.makepyfile(
+        """
+        def test_circular_metadata(json_metadata):
+            json_metadata['self'] = json_metadata
+    """
+    )
+    res = pytester.runpytest("--hw-test-report")
+    assert res.ret == 0
+    data = load_report(report_path)
+    assert "metadata" not in data["tests"][0]
+    assert "not JSON-serializable" in data["warnings"][0]["message"]
+
+
+def test_metadata_fixture_without_report_flag(pytester, report_path):
     """Using the json_metadata fixture without --json-report should not raise
     internal errors."""
     pytester.makepyfile(
@@ -484,19 +486,18 @@ def test_metadata_fixture_without_report_flag(pytester):
     )
     res = pytester.runpytest()
     assert res.ret == 0
-    assert not (pytester.path / ".report.json").exists()
+    assert not report_path.exists()
 
 
-def test_environment_via_metadata_plugin(pytester):
+def test_environment_via_metadata_plugin(pytester, report_path):
     pytester.makepyfile("")
     pytester.runpytest("--hw-test-report", "--metadata", "x", "y")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     assert "Python" in data["environment"]
     assert data["environment"]["x"] == "y"
 
 
-def test_modifyreport_hook(pytester):
+def test_modifyreport_hook(pytester, report_path):
     pytester.makeconftest(
         """
         def pytest_json_modifyreport(json_report):
@@ -511,13 +512,12 @@ def test_modifyreport_hook(pytester):
     """
     )
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     assert data["foo"] == "bar"
     assert "summary" not in data
 
 
-def test_runtest_stage_hook(pytester):
+def test_runtest_stage_hook(pytester, report_path):
     pytester.makeconftest(
         """
         def pytest_json_runtest_stage(report):
@@ -531,15 +531,14 @@ def test_runtest_stage_hook(pytester):
     """
     )
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     test = data["tests"][0]
     assert test["setup"] == {"outcome": "passed"}
     assert test["call"] == {"outcome": "failed"}
     assert test["teardown"] == {"outcome": "passed"}
 
 
-def test_runtest_metadata_hook(pytester):
+def test_runtest_metadata_hook(pytester, report_path):
     pytester.makeconftest(
         """
         def pytest_json_runtest_metadata(item, call):
@@ -555,15 +554,58 @@ def test_runtest_metadata_hook(pytester):
     """
     )
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     test = data["tests"][0]
     assert test["metadata"]["id"].endswith("::test_foo")
     assert isinstance(test["metadata"]["start"], float)
     assert isinstance(test["metadata"]["stop"], float)
 
 
-def test_runtest_dut_hook(pytester):
+def test_runtest_metadata_hook_nested_conftest(pytester, report_path):
+    """Hooks in conftest files loaded during collection are still called."""
+    pytester.mkpydir("sub")
+    pytester.makepyfile(
+        **{
+            "sub/conftest": """
+                def pytest_json_runtest_metadata(item, call):
+                    return {'id': item.nodeid}
+            """,
+            "sub/test_foo": """
+                def test_foo():
+                    assert True
+            """,
+        }
+    )
+    pytester.runpytest("--hw-test-report")
+    data = load_report(report_path)
+    test = data["tests"][0]
+    assert test["metadata"]["id"].endswith("::test_foo")
+
+
+def test_runtest_metadata_hook_registered_late(pytester, report_path):
+    """Hooks of plugins registered while the tests run are called."""
+    pytester.makepyfile(
+        """
+        import pytest
+
+        class Plugin:
+            def pytest_json_runtest_metadata(self, item, call):
+                return {'when': call.when}
+
+        @pytest.fixture(scope="session", autouse=True)
+        def plugin(pytestconfig):
+            pytestconfig.pluginmanager.register(Plugin())
+
+        def test_foo():
+            assert True
+    """
+    )
+    pytester.runpytest("--hw-test-report")
+    data = load_report(report_path)
+    assert data["tests"][0]["metadata"] == {"when": "teardown"}
+
+
+def test_runtest_dut_hook(pytester, report_path):
     pytester.makeconftest(
         """
         def pytest_json_runtest_dut(item, call):
@@ -579,15 +621,14 @@ def test_runtest_dut_hook(pytester):
     """
     )
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     test = data["tests"][0]
     assert test["DUT"]["id"].endswith("::test_foo")
     assert isinstance(test["DUT"]["start"], float)
     assert isinstance(test["DUT"]["stop"], float)
 
 
-def test_runtest_equipment_hook(pytester):
+def test_runtest_equipment_hook(pytester, report_path):
     pytester.makeconftest(
         """
         def pytest_json_runtest_equipment(item, call):
@@ -603,15 +644,14 @@ def test_runtest_equipment_hook(pytester):
     """
     )
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     test = data["tests"][0]
     assert test["equipment"]["id"].endswith("::test_foo")
     assert isinstance(test["equipment"]["start"], float)
     assert isinstance(test["equipment"]["stop"], float)
 
 
-def test_warnings(pytester):
+def test_warnings(pytester, report_path):
     pytester.makepyfile(
         """
         class TestFoo:
@@ -622,8 +662,7 @@ def test_warnings(pytester):
     """
     )
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     warnings = data["warnings"]
     assert set(warnings[0]) == {"category", "filename", "lineno", "message", "when"}
     assert warnings[0]["category"] in ("PytestCollectionWarning", "PytestWarning")
@@ -650,16 +689,128 @@ def test_process_report(pytester):
     assert res.ret == 0
 
 
-def test_indent(pytester):
+def test_indent(pytester, report_path):
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
+    with open(report_path, encoding="utf-8") as f:
         assert len(f.readlines()) == 1
+    pytester.runpytest("--hw-test-report", "--hw-test-report-indent=2")
+    with open(report_path, encoding="utf-8") as f:
+        assert f.readlines()[1].startswith('  "')
     pytester.runpytest("--hw-test-report", "--hw-test-report-indent=4")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
+    with open(report_path, encoding="utf-8") as f:
         assert f.readlines()[1].startswith('    "')
 
 
-def test_logging(pytester):
+@pytest.mark.usefixtures("file_example")
+def test_save_report_without_orjson(pytester, report_path, monkeypatch):
+    pytester.runpytest("--hw-test-report")
+    r1 = load_report(report_path)
+
+    monkeypatch.setattr(serialize, "_orjson", lambda: None)
+    pytester.runpytest("--hw-test-report")
+    r2 = load_report(report_path)
+    assert normalize_report(r1) == normalize_report(r2)
+
+
+def test_save_report_str_conversion(pytester, report_path, monkeypatch):
+    """Values that aren't JSON-serializable are converted with `str` whether
+    orjson is installed or not."""
+    pytester.makeconftest(
+        """
+        import dataclasses
+        import datetime
+
+        @dataclasses.dataclass
+        class D:
+            a: int
+
+        def pytest_json_modifyreport(json_report):
+            json_report['datetime'] = datetime.datetime(2024, 1, 2, 3, 4, 5)
+            json_report['date'] = datetime.date(2024, 1, 2)
+            json_report['dataclass'] = D(a=1)
+    """
+    )
+    pytester.makepyfile(
+        """
+        def test_foo():
+            pass
+    """
+    )
+    reports = []
+    pytester.runpytest("--hw-test-report")
+    reports.append(load_report(report_path))
+    monkeypatch.setattr(serialize, "_orjson", lambda: None)
+    pytester.runpytest("--hw-test-report")
+    reports.append(load_report(report_path))
+
+    for report in reports:
+        assert report["datetime"] == "2024-01-02 03:04:05"
+        assert report["date"] == "2024-01-02"
+        assert report["dataclass"] == "D(a=1)"
+
+
+@pytest.mark.usefixtures("file_example")
+@pytest.mark.parametrize("use_orjson", [True, False])
+@pytest.mark.parametrize("one_shot_max_tests", [0, 1000])
+@pytest.mark.parametrize("indent", [None, 0, 2, 4])
+def test_save_report_encoding(
+    pytester, report_path, monkeypatch, indent, one_shot_max_tests, use_orjson
+):
+    """Writing the report in chunks must match encoding it at once."""
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(serialize, "_orjson", lambda: None)
+    monkeypatch.setattr("pytest_htr.plugin._ONE_SHOT_MAX_TESTS", one_shot_max_tests)
+    args = ["--hw-test-report"]
+    if indent is not None:
+        args.append(f"--hw-test-report-indent={indent}")
+    pytester.runpytest(*args)
+    data = report_path.read_bytes()
+    assert data == serialize.dumps(json.loads(data), indent)
+
+
+@pytest.mark.parametrize("one_shot_max_tests", [0, 1000])
+def test_save_report_non_str_keys(pytester, report_path, monkeypatch, one_shot_max_tests):
+    """Keys that aren't strings are converted to strings like `json.dumps` does."""
+    monkeypatch.setattr("pytest_htr.plugin._ONE_SHOT_MAX_TESTS", one_shot_max_tests)
+    pytester.makeconftest(
+        """
+        def pytest_json_modifyreport(json_report):
+            json_report[1] = 'one'
+            json_report[2.5] = 'two and a half'
+            json_report[None] = 'none'
+    """
+    )
+    pytester.makepyfile(
+        """
+        def test_foo():
+            pass
+    """
+    )
+    pytester.runpytest("--hw-test-report")
+    data = load_report(report_path)
+    assert data["1"] == "one"
+    assert data["2.5"] == "two and a half"
+    assert data["null"] == "none"
+
+
+@pytest.mark.usefixtures("file_example")
+@pytest.mark.parametrize("indent", [None, 4])
+def test_eager_encode(pytester, report_path, indent):
+    args = ["--hw-test-report"]
+    if indent is not None:
+        args.append(f"--hw-test-report-indent={indent}")
+    pytester.runpytest(*args)
+    r1 = report_path.read_text(encoding="utf-8")
+
+    pytester.runpytest(*args, "--hw-test-report-eager-encode")
+    r2 = report_path.read_text(encoding="utf-8")
+    assert normalize_report(json.loads(r1)) == normalize_report(json.loads(r2))
+    assert len(r1.splitlines()) == len(r2.splitlines())
+
+
+def test_logging(pytester, report_path):
     pytester.makepyfile(
         """
         import logging
@@ -678,23 +829,38 @@ def test_logging(pytester):
                 raise
             except (RuntimeError, TypeError): # TypeError is raised in Py 2.7
                 logging.getLogger().debug('log %s', 'debug', exc_info=True)
+            logging.info('log stack', stack_info=True)
     """
     )
     pytester.runpytest("--hw-test-report", "--log-level=DEBUG")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
     test = data["tests"][0]
     assert test["setup"]["log"][0]["msg"] == "log info"
     assert test["call"]["log"][0]["msg"] == "log error"
     assert test["call"]["log"][1]["msg"] == "log debug"
     assert test["teardown"]["log"][0]["msg"] == "log warn"
+    assert set(test["call"]["log"][0]) == {
+        "name",
+        "msg",
+        "levelname",
+        "levelno",
+        "pathname",
+        "lineno",
+        "funcName",
+        "created",
+        "msecs",
+    }
+    assert "RuntimeError" in test["call"]["log"][1]["exc_text"]
+    assert "stack_info" not in test["call"]["log"][1]
+    assert "test_foo" in test["call"]["log"][2]["stack_info"]
+    assert "exc_text" not in test["call"]["log"][2]
 
     record = logging.makeLogRecord(test["call"]["log"][1])
     assert record.getMessage() == record.msg == "log debug"
 
 
-def test_no_logs(pytester):
+def test_no_logs(pytester, report_path):
     pytester.makepyfile(
         """
         import logging
@@ -703,26 +869,17 @@ def test_no_logs(pytester):
     """
     )
     pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
     assert "log" in data["tests"][0]["call"]
 
-    pytester.makepyfile(
-        """
-        import logging
-        def test_foo():
-            logging.error('log error')
-    """
-    )
     pytester.runpytest("--hw-test-report", "--hw-test-report-omit=log")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
 
     assert "log" not in data["tests"][0]["call"]
 
 
-def test_no_warnings(pytester):
+def test_no_warnings(pytester, report_path):
     pytester.makepyfile(
         """
         class TestFoo:
@@ -733,8 +890,7 @@ def test_no_warnings(pytester):
     """
     )
     pytester.runpytest("--hw-test-report", "--hw-test-report-omit=warnings")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_report(report_path)
     assert "warnings" not in data
 
 
@@ -754,6 +910,7 @@ def test_direct_invocation(pytester):
     plugin = JSONReport()
     res = pytest.main([test_file], plugins=[plugin])
     assert res == 0
+    assert not any(isinstance(h, LoggingHandler) for h in logging.getLogger().handlers)
     assert plugin.report["exitcode"] == 0
     assert plugin.report["summary"]["total"] == 1
 
@@ -763,26 +920,48 @@ def test_direct_invocation(pytester):
     assert report_path.exists()
 
 
-def test_xdist(pytester, match_reports):
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        r1 = json.load(f)
-
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report", "-n=1")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        r2 = json.load(f)
-
-    pytester.makepyfile(FILE)
-    pytester.runpytest("--hw-test-report", "-n=4")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        r3 = json.load(f)
-    assert match_reports(r1, r2)
-    assert match_reports(r2, r3)
-
-
-def test_flaky(pytester):
+def test_xdist(pytester, file_source, match_reports):
+    # Each run gets its own directory, so they don't collect each other's files
+    dirs = {}
+    for name in ("no_workers", "n1", "n4"):
+        dirs[name] = pytester.mkdir(name)
+        shutil.copy(file_source, dirs[name])
+
+    # The run without workers is independent of the others, so it runs in a
+    # subprocess meanwhile. The runs with workers stay in-process, so the
+    # controller side of the plugin is covered.
+    output_path = dirs["no_workers"] / "output.txt"
+    with open(output_path, "wb") as output, subprocess.Popen(
+        [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", "--hw-test-report"],
+        cwd=dirs["no_workers"],
+        stdout=output,
+        stderr=subprocess.STDOUT,
+    ) as proc:
+        try:
+            reports = {}
+            for name, n in (("n1", 1), ("n4", 4)):
+                report_file = dirs[name] / ".report.json"
+                res = pytester.runpytest(
+                    "--hw-test-report",
+                    f"--hw-test-report-file={report_file}",
+                    f"-n={n}",
+                    dirs[name],
+                )
+                assert res.ret == 1, res.stdout.str()
+                reports[name] = load_report(report_file)
+            returncode = proc.wait(timeout=120)
+        finally:
+            # Don't leave the subprocess running if the test fails early
+            proc.kill()
+    assert returncode == 1, output_path.read_text(encoding="utf-8")
+    reports["no_workers"] = load_report(dirs["no_workers"] / ".report.json")
+
+    assert match_reports(reports["no_workers"], reports["n1"])
+    assert match_reports(reports["n1"], reports["n4"])
+
+
+@pytest.mark.parametrize("args", [(), ("--hw-test-report-eager-encode",)])
+def test_flaky(pytester, report_path, args):
     pytester.makepyfile(
         """
         from flaky import flaky
@@ -800,9 +979,8 @@ def test_flaky(pytester):
             assert FLAKY_RUNS == 2
     """
     )
-    pytester.runpytest("--hw-test-report")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    pytester.runpytest("--hw-test-report", "--hw-test-report-omit", "streams", "log", *args)
+    data = load_report(report_path)
 
     assert set(data["summary"].items()) == {
         ("total", 2),
@@ -829,7 +1007,7 @@ def test_handle_deselection(pytester):
 
 
 @pytest.mark.parametrize("num_processes", [1, 4])
-def test_xdist_crash(pytester, num_processes):
+def test_xdist_crash(pytester, report_path, num_processes):
     """Check that a crashing xdist worker doesn't kill the whole test run."""
     pytester.makepyfile(
         """
@@ -842,9 +1020,10 @@ def test_xdist_crash(pytester, num_processes):
                 os._exit(1)
     """
     )
-    pytester.runpytest("--hw-test-report", f"-n={num_processes}")
-    with open(pytester.path / ".report.json", encoding="utf-8") as f:
-        data = json.load(f)
+    pytester.runpytest(
+        "--hw-test-report", f"-n={num_processes}", "--hw-test-report-omit", "streams", "log"
+    )
+    data = load_report(report_path)
 
     assert data["exitcode"] == 1
     assert data["summary"]["passed"] == 9